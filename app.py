@@ -1,5 +1,10 @@
+import hashlib
+import os
+
+import numpy as np
 import streamlit as st
 import pandas as pd
+from ortools.sat.python import cp_model
 from solver import SchoolScheduler  # 確保 solver.py 必須在同一個資料夾內
 
 # --- 頁面基本設定 ---
@@ -14,6 +19,7 @@ st.title("🏫 國高中智慧排課系統 (完整版)")
 # ==========================================
 # 1. 核心邏輯：模擬資料產生器
 # ==========================================
+@st.cache_data
 def get_simulation_data():
     """
     生成 10 個班級、10 位老師，以及指定的課程結構。
@@ -33,24 +39,93 @@ def get_simulation_data():
         ('生活科技', 1), ('資訊科技', 1)
     ]
     
-    data = []
     num_teachers = len(teachers)
     
-    for class_idx, class_name in enumerate(classes):
-        for subj_idx, (subj_name, hours) in enumerate(subjects_config):
-            # 演算法：(班級ID + 科目ID) % 老師總數
-            # 確保老師被均勻錯開，避免同一位老師在同一時段要教多個班
-            teacher_idx = (class_idx + subj_idx) % num_teachers
-            teacher_name = teachers[teacher_idx]
-            
-            data.append({
-                'class': class_name,
-                'teacher': teacher_name,
-                'subject': subj_name,
-                'hours': hours
-            })
-            
-    return pd.DataFrame(data)
+    # 以 NumPy 一次展開 (班級 x 科目) 的所有組合
+    class_idx = np.repeat(np.arange(len(classes)), len(subjects_config))
+    subj_idx = np.tile(np.arange(len(subjects_config)), len(classes))
+    
+    # 演算法：(班級ID + 科目ID) % 老師總數
+    # 確保老師被均勻錯開，避免同一位老師在同一時段要教多個班
+    teacher_idx = (class_idx + subj_idx) % num_teachers
+    
+    subj_names = np.array([s for s, _ in subjects_config])[subj_idx]
+    hours = np.array([h for _, h in subjects_config])[subj_idx]
+    
+    return pd.DataFrame({
+        'class': np.array(classes)[class_idx],
+        'teacher': np.array(teachers)[teacher_idx],
+        'subject': subj_names,
+        'hours': hours
+    })
+
+# ==========================================
+# 1.5 建模與求解 (成功的結果由下方以 Session State 快取)
+# ==========================================
+def solve_schedule(df, days, periods, num_workers, warm_start=None):
+    """
+    建立排課模型並求解。
+    warm_start (上一次的排課結果) 只作為提示。
+    回傳 (結果 DataFrame, 排課布林陣列, 求解狀態)。
+    """
+    # 模型每次求解都重新建立，不在 session 之間共用 (solve() 會修改模型的提示)
+    scheduler = SchoolScheduler(
+        df['class'].to_numpy(), df['teacher'].to_numpy(),
+        df['subject'].to_numpy(), df['hours'].to_numpy(),
+        days=days, periods=periods, num_workers=num_workers
+    )
+    result_df = scheduler.solve(warm_start=warm_start)
+    return result_df, scheduler.last_assignment, scheduler.status
+
+
+# 名稱欄位一律先讀成字串 (避免 101 之類的班級被推斷成數字，且不因 engine 而異)，再轉成 category
+COURSE_DTYPES = {'class': 'string', 'teacher': 'string', 'subject': 'string', 'hours': 'int16'}
+CATEGORY_COLUMNS = ['class', 'teacher', 'subject']
+
+
+@st.cache_data(show_spinner=False)
+def load_courses_csv(uploaded_file):
+    """
+    讀取上傳的開課需求 CSV。
+    預先指定欄位型別省去型別推斷；有安裝 pyarrow 時用它多執行緒解析，否則退回 C engine。
+    """
+    try:
+        df = pd.read_csv(uploaded_file, dtype=COURSE_DTYPES, engine='pyarrow')
+    except ImportError:
+        uploaded_file.seek(0)
+        df = pd.read_csv(uploaded_file, dtype=COURSE_DTYPES, engine='c')
+    return df.astype(dict.fromkeys(CATEGORY_COLUMNS, 'category'))
+
+
+@st.cache_data(show_spinner=False)
+def df_to_csv_bytes(df):
+    """
+    將 DataFrame 轉成 CSV (utf-8-sig，Excel 開啟不亂碼)，下載按鈕不必每次重新編碼。
+    """
+    return df.to_csv(index=False).encode('utf-8-sig')
+
+def build_pivots(result_df, key_col, periods):
+    """
+    依 key_col (班級或老師) 分組，一次製作所有週課表 Pivot Table (列=節次, 欄=星期)
+    回傳 {名稱: pivot_df}，查詢時直接取用，不必每次重新 pivot
+    """
+    # 定義排序邏輯 (確保週一排在週二前面，而不是按筆劃)
+    days_order = ['週一', '週二', '週三', '週四', '週五']
+    periods_order = [f'第 {i} 節' for i in range(1, periods + 1)]
+    
+    # 重新索引 (Reindex) 以確保顯示順序正確，並填補空值
+    # 這裡用 set 交集防止模擬資料天數跟設定不一致報錯
+    used_days = set(result_df['星期'].unique())
+    used_periods = set(result_df['節次'].unique())
+    valid_days = [d for d in days_order if d in used_days]
+    valid_periods = [p for p in periods_order if p in used_periods]
+    
+    return {
+        name: sub.pivot(index='節次', columns='星期', values='科目')
+                 .reindex(index=valid_periods, columns=valid_days)
+                 .fillna("")  # 空堂顯示空白
+        for name, sub in result_df.groupby(key_col, sort=False)
+    }
 
 # ==========================================
 # 2. 側邊欄設定
@@ -58,6 +133,11 @@ def get_simulation_data():
 with st.sidebar:
     st.header("⚙️ 參數設定")
     periods_per_day = st.slider("每天總節數", min_value=5, max_value=9, value=7, help="若課程總數為26節，建議至少設為7節以免空間不足")
+    max_cores = os.cpu_count() or 1
+    if max_cores > 1:
+        num_workers = st.slider("CPU 核心數", min_value=1, max_value=max_cores, value=min(4, max_cores), help="CP-SAT 平行搜尋使用的核心數")
+    else:
+        num_workers = 1
     st.info("💡 模擬模式預設為：\n10 個班級 / 10 位老師\n每班每週 26 節課")
 
 # ==========================================
@@ -75,8 +155,14 @@ with col2:
 # 決定使用哪份資料
 df = None
 if uploaded_file:
-    df = pd.read_csv(uploaded_file)
-    st.success(f"已讀取上傳檔案，共 {len(df)} 筆需求")
+    df = load_courses_csv(uploaded_file)
+    blank_rows = df[CATEGORY_COLUMNS].isna().any(axis=1)
+    if blank_rows.any():
+        st.error(f"❌ 上傳檔案的 class / teacher / subject 有空白欄位 (共 {blank_rows.sum()} 筆)，請補齊後再上傳。")
+        st.dataframe(df[blank_rows])
+        df = None
+    else:
+        st.success(f"已讀取上傳檔案，共 {len(df)} 筆需求")
 elif use_simulation:
     df = get_simulation_data()
     st.info(f"已生成模擬資料，共 {len(df)} 筆需求 (10班 x 10科)")
@@ -93,22 +179,37 @@ if df is not None:
     
     if st.button("🚀 開始運算 (Run Solver)", type="primary"):
         with st.spinner('AI 正在進行矩陣運算，請稍候...'):
-            # 準備資料
-            courses_data = df.to_dict('records')
+            # 以課程內容計算 hash，相同的 (課程, 節數, 核心數) 不重複建模與求解
+            courses_hash = hashlib.blake2b(df.to_csv(index=False).encode(), digest_size=8).hexdigest()
+            solver_key = f'solver_{courses_hash}_{periods_per_day}_{num_workers}'
             
-            # 初始化 Solver (傳入每天節數設定)
-            scheduler = SchoolScheduler(courses_data, periods=periods_per_day) 
-            
-            # 開始計算
-            result_df = scheduler.solve()
+            if solver_key in st.session_state:
+                result_df, assignment = st.session_state[solver_key]
+            else:
+                # 課程內容沒變時，以上一次的解作為 warm start (例如只調整每天節數)
+                warm_start = None
+                if st.session_state.get('last_courses_hash') == courses_hash:
+                    warm_start = st.session_state.get('last_assignment')
+                
+                result_df, assignment, status = solve_schedule(df, 5, periods_per_day, num_workers, warm_start)
+                # 只保存成功的結果；無解或逾時時下次按下仍會重新求解
+                if result_df is not None:
+                    st.session_state[solver_key] = (result_df, assignment)
             
             # --- 處理運算結果 ---
             if result_df is not None:
                 st.session_state['result_df'] = result_df # 存入 Session State 防止重整後消失
+                st.session_state['last_courses_hash'] = courses_hash
+                st.session_state['last_assignment'] = assignment
+                # 預先製作每個班級/老師的週課表，查詢時不必重算
+                st.session_state['pivots_by_class'] = build_pivots(result_df, '班級', periods_per_day)
+                st.session_state['pivots_by_teacher'] = build_pivots(result_df, '老師', periods_per_day)
                 st.balloons()
                 st.success("✅ 排課成功！已找到最佳解。")
-            else:
+            elif status == cp_model.INFEASIBLE:
                 st.error("❌ 無解 (Infeasible)。請檢查是否老師時數過度集中或總節數不足。")
+            else:
+                st.warning("⏱️ 已達運算時間上限，尚未找到可行解 (也未證明無解)。可再試一次或調整節數設定。")
 
 # ==========================================
 # 5. 結果顯示與查詢 (讀取 Session State)
@@ -118,7 +219,7 @@ if 'result_df' in st.session_state:
     
     # 下載區
     st.markdown("### 📥 下載結果")
-    csv = result_df.to_csv(index=False).encode('utf-8-sig')
+    csv = df_to_csv_bytes(result_df)
     st.download_button(
         label="下載完整課表 (CSV)",
         data=csv,
@@ -139,31 +240,15 @@ if 'result_df' in st.session_state:
     with q_col2:
         target = None
         if query_type == "依班級查課表":
-            class_list = sorted(result_df['班級'].unique())
-            target = st.selectbox("請選擇班級", class_list)
-            filtered_df = result_df[result_df['班級'] == target]
+            pivots = st.session_state['pivots_by_class']
+            target = st.selectbox("請選擇班級", sorted(pivots))
         else:
-            teacher_list = sorted(result_df['老師'].unique())
-            target = st.selectbox("請選擇老師", teacher_list)
-            filtered_df = result_df[result_df['老師'] == target]
+            pivots = st.session_state['pivots_by_teacher']
+            target = st.selectbox("請選擇老師", sorted(pivots))
 
     # 顯示週課表
     if target:
         st.write(f"### 📋 {target} 的課表")
         
-        # 製作 Pivot Table (列=節次, 欄=星期)
-        pivot_df = filtered_df.pivot(index='節次', columns='星期', values='科目')
-        
-        # 定義排序邏輯 (確保週一排在週二前面，而不是按筆劃)
-        days_order = ['週一', '週二', '週三', '週四', '週五']
-        periods_order = [f'第 {i} 節' for i in range(1, periods_per_day + 1)]
-        
-        # 重新索引 (Reindex) 以確保顯示順序正確，並填補空值
-        # 這裡用 set 交集防止模擬資料天數跟設定不一致報錯
-        valid_days = [d for d in days_order if d in result_df['星期'].unique()]
-        valid_periods = [p for p in periods_order if p in result_df['節次'].unique()]
-        
-        pivot_df = pivot_df.reindex(index=valid_periods, columns=valid_days)
-        
         # 顯示表格 (使用 st.dataframe 可以互動，st.table 比較像靜態報表)
-        st.table(pivot_df.fillna("")) # 空堂顯示空白
\ No newline at end of file
+        st.table(pivots[target])
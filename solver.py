@@ -1,29 +1,61 @@
+import numpy as np
 import pandas as pd
 from ortools.sat.python import cp_model
 
 class SchoolScheduler:
-    def __init__(self, courses_data, days=5, periods=7):
+    def __init__(self, classes, teachers, subjects, hours, days=5, periods=7, num_workers=8):
         """
         初始化排課器
-        :param courses_data: list of dict, 包含開課資訊 [{'class': '101', 'teacher': '王老師', 'subject': '國文', 'hours': 4}, ...]
+        開課資訊以四個等長陣列傳入 (第 i 筆 = 第 i 門課)，例如 DataFrame 的欄位 .to_numpy()
+        :param classes: 班級陣列 ['101', '101', ...]
+        :param teachers: 老師陣列 ['王老師', '李老師', ...]
+        :param subjects: 科目陣列 ['國文', '英文', ...]
+        :param hours: 每週節數陣列 [4, 4, ...]
         :param days: 每週天數 (預設5天)
         :param periods: 每天節數 (預設7節)
+        :param num_workers: CP-SAT 平行搜尋的 worker 數 (預設8)
         """
-        self.courses = courses_data
+        self.hours = np.asarray(hours, dtype=np.int16)
+        self.num_courses = len(self.hours)
         self.days = days
         self.periods = periods
         self.model = cp_model.CpModel()
         self.solver = cp_model.CpSolver()
         
+        # 求解器參數: 多核心平行搜尋 + 時間上限
+        self.solver.parameters.num_workers = num_workers
+        self.solver.parameters.log_search_progress = False
+        self.solver.parameters.max_time_in_seconds = 60
+        self.solver.parameters.linearization_level = 2  # AMO 限制用較強的 LP 鬆弛
+        self.solver.parameters.cp_model_presolve = True
+        
+        # 搜尋策略使用多種策略的組合 (portfolio)
+        self.solver.parameters.search_branching = cp_model.PORTFOLIO_SEARCH
+        
         # 建立索引映射 (為了處理字串名稱)
-        self.all_teachers = sorted(list(set(c['teacher'] for c in self.courses)))
-        self.all_classes = sorted(list(set(c['class'] for c in self.courses)))
+        # 將名稱轉成整數 ID，之後的比較與分組都只用整數
+        # class_ids[i] 為第 i 門課的班級在 all_classes 中的位置 (老師、科目同理)
+        # pd.factorize 以 hash table 去重，sort=True 只需排序去重後的少量名稱
+        self.class_ids, self.all_classes = pd.factorize(np.asarray(classes, dtype=object), sort=True)
+        self.teacher_ids, self.all_teachers = pd.factorize(np.asarray(teachers, dtype=object), sort=True)
+        self.subject_ids, self.all_subjects = pd.factorize(np.asarray(subjects, dtype=object), sort=True)
+        # factorize 會把空值編成 -1，之後拿來當 index 會默默排錯，直接拒絕
+        for label, ids in (('class', self.class_ids), ('teacher', self.teacher_ids), ('subject', self.subject_ids)):
+            if (ids < 0).any():
+                rows = np.flatnonzero(ids < 0).tolist()
+                raise ValueError(f"{label} 欄位有空值 (第 {rows} 筆課程)")
         
         # 決策變數儲存容器
-        # 結構: self.vars[(course_index, day, period)] = BoolVar
-        self.vars = {} 
+        # 結構: self.vars[course_index, day, period] = BoolVar (連續的 3 維陣列)
+        self.vars = np.empty((self.num_courses, self.days, self.periods), dtype=object)
+        
+        # 最近一次求解的狀態 (OPTIMAL / FEASIBLE / INFEASIBLE / UNKNOWN...)
+        self.status = None
+        # 最近一次求得的排課結果 (課程數, 天數, 節數) 布林陣列，可作為下次求解的 warm start
+        self.last_assignment = None
         
         self._create_variables()
+        self._add_symmetry_breaking()
         self._add_hard_constraints()
 
     def _create_variables(self):
@@ -32,13 +64,38 @@ class SchoolScheduler:
         我們為每一個 '課程' 在每一個 '時間格' 建立一個布林變數 (0 或 1)
         如果是 1，代表這門課排在這個時間。
         """
-        print(f"正在建立變數... (課程數: {len(self.courses)}, 時間格: {self.days * self.periods})")
+        print(f"正在建立變數... (課程數: {self.num_courses}, 時間格: {self.days * self.periods})")
         
-        for c_idx, course in enumerate(self.courses):
+        for c_idx in range(self.num_courses):
             for d in range(self.days):
                 for p in range(self.periods):
                     # 變數名稱範例: c0_d1_p3 (第0號課程, 第1天, 第3節)
-                    self.vars[(c_idx, d, p)] = self.model.NewBoolVar(f'c{c_idx}_d{d}_p{p}')
+                    self.vars[c_idx, d, p] = self.model.NewBoolVar(f'c{c_idx}_d{d}_p{p}')
+
+    def _add_symmetry_breaking(self):
+        """
+        步驟 1.5: 打破對稱性
+        (班級, 老師, 科目, 節數) 完全相同的課程可以互換，
+        這裡要求它們的時間格向量依字典序排列，避免 Solver 搜尋等價的排列組合。
+        """
+        num_slots = self.days * self.periods
+        # 以 2 的次方當權重做字典序比較，時間格太多時係數會溢位，直接略過
+        if num_slots > 62:
+            return
+
+        groups = {}
+        for c_idx in range(self.num_courses):
+            key = (self.class_ids[c_idx], self.teacher_ids[c_idx], self.subject_ids[c_idx], self.hours[c_idx])
+            groups.setdefault(key, []).append(c_idx)
+
+        # 越早的時間格權重越大，加權和的大小即等同字典序
+        weights = [1 << (num_slots - 1 - k) for k in range(num_slots)]
+        for idxs in groups.values():
+            for a, b in zip(idxs, idxs[1:]):
+                self.model.Add(
+                    cp_model.LinearExpr.WeightedSum(self.vars[a].ravel().tolist(), weights)
+                    >= cp_model.LinearExpr.WeightedSum(self.vars[b].ravel().tolist(), weights)
+                )
 
     def _add_hard_constraints(self):
         """
@@ -48,77 +105,138 @@ class SchoolScheduler:
 
         # --- 限制 A: 課時滿足 ---
         # 每門課必須剛好排滿指定的節數 (hours)
-        for c_idx, course in enumerate(self.courses):
-            required_hours = course['hours']
-            # 取出這門課在所有時間格的變數，加總必須等於 required_hours
-            self.model.Add(
-                sum(self.vars[(c_idx, d, p)] for d in range(self.days) for p in range(self.periods)) 
-                == required_hours
-            )
+        # 先將每門課在所有時間格的變數攤平成一個 list，之後不必重複產生
+        self.cell_vars_per_course = [
+            self.vars[c_idx].ravel().tolist() for c_idx in range(self.num_courses)
+        ]
+        for c_idx in range(self.num_courses):
+            required_hours = int(self.hours[c_idx])
+            self.model.Add(cp_model.LinearExpr.Sum(self.cell_vars_per_course[c_idx]) == required_hours)
+
+        # 將課程 index 依 班級/老師 分組 (排序一次即可，不必逐一比對)
+        class_groups = self._group_indices(self.class_ids, len(self.all_classes))
+        teacher_groups = self._group_indices(self.teacher_ids, len(self.all_teachers))
 
         # --- 限制 B: 班級不衝堂 ---
-        # 同一個班級，在同一個時間 (d, p)，所有的課程變數加總 <= 1
-        for cls in self.all_classes:
-            # 找出屬於這個班級的所有課程 index
-            class_course_indices = [i for i, c in enumerate(self.courses) if c['class'] == cls]
-            
+        # 同一個班級，在同一個時間 (d, p)，最多只能有一門課
+        # AddAtMostOne 使用專門的 propagator，比一般的線性 <= 1 更有效率
+        for idxs in class_groups:
             for d in range(self.days):
                 for p in range(self.periods):
-                    self.model.Add(
-                        sum(self.vars[(idx, d, p)] for idx in class_course_indices) <= 1
-                    )
+                    self._add_at_most_one(self.vars[idxs, d, p].tolist())
 
         # --- 限制 C: 老師不衝堂 ---
-        # 同一位老師，在同一個時間 (d, p)，所有的課程變數加總 <= 1
-        for teacher in self.all_teachers:
-            # 找出這位老師教的所有課程 index
-            teacher_course_indices = [i for i, c in enumerate(self.courses) if c['teacher'] == teacher]
-            
+        # 同一位老師，在同一個時間 (d, p)，最多只能有一門課
+        for idxs in teacher_groups:
             for d in range(self.days):
                 for p in range(self.periods):
-                    self.model.Add(
-                        sum(self.vars[(idx, d, p)] for idx in teacher_course_indices) <= 1
-                    )
+                    self._add_at_most_one(self.vars[idxs, d, p].tolist())
+
+    def _add_at_most_one(self, bool_vars):
+        """
+        加入「最多只有一個為 1」的限制
+        舊版 OR-Tools 沒有 AddAtMostOne 時，退回線性 <= 1 (用 LinearExpr.Sum 一次建好)
+        """
+        if hasattr(self.model, 'AddAtMostOne'):
+            self.model.AddAtMostOne(bool_vars)
+        else:
+            self.model.Add(cp_model.LinearExpr.Sum(bool_vars) <= 1)
+
+    @staticmethod
+    def _group_indices(ids, num_groups):
+        """
+        依整數 ID 將課程 index 分組: 回傳 list，第 k 個元素為 ID == k 的所有課程 index
+        """
+        order = np.argsort(ids, kind='stable')
+        boundaries = np.searchsorted(ids[order], np.arange(num_groups + 1))
+        return [order[boundaries[k]:boundaries[k + 1]].tolist() for k in range(num_groups)]
 
-    def solve(self):
+    def solve(self, warm_start=None):
         """
         步驟 3: 開始求解
+        :param warm_start: 上一次的排課結果 (課程數, 天數, 節數) 布林陣列，作為提示；
+                           沒有提供 (或課程數不同) 時改用貪婪法產生的初始解
         """
+        # 以先前的解或貪婪法初始解當作提示 (hint)，讓 Solver 從接近可行的狀態開始搜尋
+        if warm_start is not None and warm_start.shape[0] == self.num_courses:
+            seed = self._fit_warm_start(warm_start)
+        else:
+            seed = self._greedy_seed()
+        self.model.ClearHints()  # 模型可能被重複求解，先清掉舊的提示
+        for v, value in zip(self.vars.ravel().tolist(), seed.ravel().tolist()):
+            self.model.AddHint(v, int(value))
+
         print("開始運算最佳解 (Solver Running)...")
-        status = self.solver.Solve(self.model)
+        self.status = self.solver.Solve(self.model)
 
-        if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
+        if self.status == cp_model.OPTIMAL or self.status == cp_model.FEASIBLE:
             print("找到可行解！")
             return self._format_solution()
-        else:
+        elif self.status == cp_model.INFEASIBLE:
             print("無解 (Infeasible)！可能是課程太多或限制太嚴格。")
             return None
+        else:
+            # 例如超過時間上限 (UNKNOWN)：沒有找到解，但也沒有證明無解
+            print(f"未能在時間內求得結果 ({self.solver.StatusName(self.status)})。")
+            return None
+
+    def _fit_warm_start(self, warm_start):
+        """
+        將先前的排課結果套到目前的 (天數, 節數)，只保留重疊的時間格
+        """
+        seed = np.zeros(self.vars.shape, dtype=bool)
+        d = min(self.days, warm_start.shape[1])
+        p = min(self.periods, warm_start.shape[2])
+        seed[:, :d, :p] = warm_start[:, :d, :p]
+        return seed
+
+    def _greedy_seed(self):
+        """
+        貪婪法排課: 節數多的課程先排，每節放進第一個「班級與老師都有空」的時間格
+        回傳 (課程數, 天數, 節數) 的布林陣列；排不下的節數就留空，不保證可行
+        """
+        seed = np.zeros(self.vars.shape, dtype=bool)
+        class_busy = np.zeros((len(self.all_classes), self.days, self.periods), dtype=bool)
+        teacher_busy = np.zeros((len(self.all_teachers), self.days, self.periods), dtype=bool)
+
+        for c_idx in np.argsort(-self.hours, kind='stable'):
+            cls_id = self.class_ids[c_idx]
+            t_id = self.teacher_ids[c_idx]
+            free = np.argwhere(~(class_busy[cls_id] | teacher_busy[t_id]))
+            for d, p in free[:int(self.hours[c_idx])]:
+                seed[c_idx, d, p] = True
+                class_busy[cls_id, d, p] = True
+                teacher_busy[t_id, d, p] = True
+
+        return seed
 
     def _format_solution(self):
         """
         將結果轉換為 Pandas DataFrame 方便檢視
         """
-        schedule_data = []
-        days_map = {0: '週一', 1: '週二', 2: '週三', 3: '週四', 4: '週五'}
+        day_names = np.array(['週一', '週二', '週三', '週四', '週五'])
+        period_names = np.array([f'第 {p+1} 節' for p in range(self.periods)])
         
-        for c_idx, course in enumerate(self.courses):
-            for d in range(self.days):
-                for p in range(self.periods):
-                    if self.solver.Value(self.vars[(c_idx, d, p)]) == 1:
-                        schedule_data.append({
-                            '班級': course['class'],
-                            '節次': f'第 {p+1} 節',
-                            '星期': days_map[d],
-                            '科目': course['subject'],
-                            '老師': course['teacher'],
-                            'Day_Index': d, # 為了排序用
-                            'Period_Index': p
-                        })
+        # 一次取出所有變數的值，再用 argwhere 找出被排入的 (課程, 天, 節)
+        values = np.fromiter(
+            (self.solver.Value(v) for v in self.vars.ravel()), dtype=np.int8, count=self.vars.size
+        ).reshape(self.vars.shape)
+        self.last_assignment = values == 1
+        idx = np.argwhere(self.last_assignment)
+        
+        # 排序讓表格好看一點: 依 (班級, 天, 節) 對整數陣列排序
+        # all_classes 已排序，class_id 的順序即等同班級名稱順序
+        order = np.lexsort((idx[:, 2], idx[:, 1], self.class_ids[idx[:, 0]]))
+        idx = idx[order]
+        c_idx, d_idx, p_idx = idx[:, 0], idx[:, 1], idx[:, 2]
         
-        df = pd.DataFrame(schedule_data)
-        # 排序讓表格好看一點
-        df = df.sort_values(by=['班級', 'Day_Index', 'Period_Index'])
-        return df[['班級', '星期', '節次', '科目', '老師']]
+        return pd.DataFrame({
+            '班級': self.all_classes[self.class_ids[c_idx]],
+            '星期': day_names[d_idx],
+            '節次': period_names[p_idx],
+            '科目': self.all_subjects[self.subject_ids[c_idx]],
+            '老師': self.all_teachers[self.teacher_ids[c_idx]],
+        })
 
 # --- 測試區 (Main Block) ---
 if __name__ == "__main__":
@@ -136,7 +254,12 @@ if __name__ == "__main__":
     ]
 
     # 設定每週 5 天，每天 4 節課 (為了測試方便縮小範圍)
-    scheduler = SchoolScheduler(mock_data, days=5, periods=4)
+    mock_df = pd.DataFrame(mock_data)
+    scheduler = SchoolScheduler(
+        mock_df['class'].to_numpy(), mock_df['teacher'].to_numpy(),
+        mock_df['subject'].to_numpy(), mock_df['hours'].to_numpy(),
+        days=5, periods=4
+    )
     result_df = scheduler.solve()
 
     if result_df is not None: